@@ -0,0 +1,351 @@
+#!/usr/bin/python3
+"""
+Browsable archive of the changes stored in a source's versions table,
+nyt_versions unless --source says otherwise
+
+    python archive.py build --out archive/
+    python archive.py article nyt://article/...
+    python archive.py --sources sources.json --source guardian stats
+
+build writes a static site to --out: a page and a JSON timeline for
+every article, the number of changes per day and the most edited
+articles. A manifest of how many versions each article had is kept with
+it, and later builds only rewrite the articles that changed since.
+Versions are streamed from the database, never loaded all at once.
+"""
+
+import argparse
+import hashlib
+import html
+import json
+import os
+
+from sqlalchemy import func, select
+
+import nytdiff
+
+MOST_EDITED = 100
+# Articles whose versions are read with each query
+BATCH = 500
+
+STYLE = """
+body { font-family: Georgia, serif; max-width: 50em; margin: 2em auto; }
+ins { background-color: aquamarine; text-decoration: none; font-weight: bold; }
+del { background-color: pink; }
+td, th { padding: 0.2em 0.6em; text-align: left; vertical-align: top; }
+"""
+
+
+def stream(db, query):
+    # Rows of query as dicts, fetched as they are read (a server side
+    # cursor on PostgreSQL)
+    conn = db.executable.execution_options(stream_results=True)
+    for row in conn.execute(query):
+        yield dict(row._mapping)
+
+
+def slug(article_id):
+    return hashlib.blake2b(article_id.encode("utf8"), digest_size=10).hexdigest()
+
+
+class History(object):
+    """
+    read-only queries over the versions table of a source
+    """
+
+    def __init__(self, db=None, source=nytdiff.NYT_SOURCE):
+        self.db = db or nytdiff.connect_db()
+        self.source = source
+        self.table = self.db[source.name + "_versions"]
+
+    def version_counts(self):
+        # article_id -> number of stored versions
+        if not self.table.exists:
+            return
+        t = self.table.table
+        query = select(t.c.article_id, func.count().label("versions")).group_by(
+            t.c.article_id
+        )
+        for row in stream(self.db, query):
+            yield row["article_id"], row["versions"]
+
+    def versions(self, article_ids):
+        # Complete versions of the given articles, grouped by article and
+        # oldest first
+        t = self.table.table
+        article_ids = sorted(article_ids)
+        for start in range(0, len(article_ids), BATCH):
+            query = (
+                select(t)
+                .where(t.c.article_id.in_(article_ids[start : start + BATCH]))
+                .order_by(t.c.article_id, t.c.version)
+            )
+            yield from nytdiff.rebuild_versions(
+                stream(self.db, query), self.source.tracked, self.source.extra
+            )
+
+    def timelines(self, article_ids):
+        # (article_id, versions) for each article, one article in memory
+        # at a time
+        current = list()
+        for version in self.versions(article_ids):
+            if current and current[0]["article_id"] != version["article_id"]:
+                yield current[0]["article_id"], current
+                current = list()
+            current.append(version)
+        if current:
+            yield current[0]["article_id"], current
+
+    def day_counts(self):
+        # (day, changes) for every day with changes, a change being any
+        # version after the first
+        if not self.table.exists:
+            return
+        t = self.table.table
+        day = func.date(t.c.date_time).label("day")
+        query = (
+            select(day, func.count().label("changes"))
+            .where(t.c.version > 1)
+            .group_by(day)
+            .order_by(day)
+        )
+        for row in stream(self.db, query):
+            yield str(row["day"]), row["changes"]
+
+    def most_edited(self, limit=MOST_EDITED):
+        if not self.table.exists:
+            return
+        t = self.table.table
+        versions = func.max(t.c.version).label("versions")
+        query = (
+            select(t.c.article_id, versions)
+            .group_by(t.c.article_id)
+            .order_by(versions.desc(), t.c.article_id)
+            .limit(limit)
+        )
+        for row in stream(self.db, query):
+            yield row["article_id"], row["versions"]
+
+
+def timeline(versions, source=nytdiff.NYT_SOURCE):
+    # JSON-ready timeline: every version with the diff of each of the
+    # source's tracked fields against the one before it
+    entries = list()
+    previous = None
+    for version in versions:
+        entry = {
+            "version": version["version"],
+            "date_time": str(version["date_time"]),
+        }
+        for field in source.tracked + source.extra:
+            entry[field] = version.get(field)
+        changes = dict()
+        if previous is not None:
+            for field in source.tracked:
+                old, new = previous.get(field) or "", version.get(field) or ""
+                if old != new:
+                    granularity = "word"
+                    if field == "url":
+                        old, new = nytdiff.url_path(old), nytdiff.url_path(new)
+                        granularity = nytdiff.URL_DIFF_GRANULARITY
+                    changes[field] = nytdiff.html_diff(
+                        html.escape(old), html.escape(new), granularity
+                    )
+        entry["changes"] = changes
+        entries.append(entry)
+        previous = version
+    return entries
+
+
+def page(title, body):
+    return """<!doctype html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>{style}</style>
+</head>
+<body>
+{body}
+</body>
+</html>
+""".format(
+        title=html.escape(title), style=STYLE, body=body
+    )
+
+
+def article_page(article_id, entries, source=nytdiff.NYT_SOURCE):
+    latest = entries[-1]
+    title = latest.get("title") or article_id
+    parts = [
+        '<p><a href="../index.html">Archive</a></p>',
+        "<h1>{}</h1>".format(html.escape(title)),
+        '<p><a href="{0}">{0}</a></p>'.format(html.escape(latest["url"] or "")),
+    ]
+    for entry in reversed(entries):
+        parts.append(
+            "<h2>Version {} <small>{}</small></h2>".format(
+                entry["version"], html.escape(entry["date_time"])
+            )
+        )
+        if not entry["changes"]:
+            parts.append("<p>{}</p>".format(html.escape(entry.get("title") or "")))
+        for field, markup in entry["changes"].items():
+            parts.append(
+                "<p><b>{}</b>: {}</p>".format(html.escape(source.label(field)), markup)
+            )
+    return page(title, "\n".join(parts))
+
+
+def index_page(days, most_edited, manifest):
+    rows = list()
+    for article_id, versions in most_edited:
+        info = manifest.get(article_id, dict())
+        rows.append(
+            '<tr><td>{}</td><td><a href="articles/{}.html">{}</a></td></tr>'.format(
+                versions,
+                slug(article_id),
+                html.escape(info.get("title") or article_id),
+            )
+        )
+    day_rows = [
+        "<tr><td>{}</td><td>{}</td></tr>".format(day, changes)
+        for day, changes in reversed(days)
+    ]
+    body = """<h1>NYTdiff archive</h1>
+<h2>Most edited articles</h2>
+<table><tr><th>Versions</th><th>Headline</th></tr>
+{}
+</table>
+<h2>Changes per day</h2>
+<table><tr><th>Day</th><th>Changes</th></tr>
+{}
+</table>""".format(
+        "\n".join(rows), "\n".join(day_rows)
+    )
+    return page("NYTdiff archive", body)
+
+
+def write(path, content):
+    # Replaces the file at once, a reader never sees half of it
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf8") as f:
+        f.write(content)
+    os.replace(tmp, path)
+
+
+def build(out, history=None, full=False):
+    """
+    writes the archive to out, only the articles whose number of
+    versions changed since the last build unless full is True. Returns
+    the number of articles written
+    """
+    history = history or History()
+    articles = os.path.join(out, "articles")
+    os.makedirs(articles, exist_ok=True)
+    manifest_path = os.path.join(out, "manifest.json")
+    manifest = dict()
+    if os.path.exists(manifest_path) and not full:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    counts = dict(history.version_counts())
+    todo = [
+        article_id
+        for article_id, versions in counts.items()
+        if manifest.get(article_id, dict()).get("versions") != versions
+    ]
+    for article_id in set(manifest) - set(counts):
+        for ext in (".html", ".json"):
+            path = os.path.join(articles, slug(article_id) + ext)
+            if os.path.exists(path):
+                os.remove(path)
+        del manifest[article_id]
+    written = 0
+    for article_id, versions in history.timelines(todo):
+        entries = timeline(versions, history.source)
+        name = os.path.join(articles, slug(article_id))
+        write(
+            name + ".json",
+            json.dumps({"article_id": article_id, "versions": entries}, indent=1),
+        )
+        write(name + ".html", article_page(article_id, entries, history.source))
+        manifest[article_id] = {
+            "versions": counts[article_id],
+            "title": entries[-1].get("title"),
+            "slug": slug(article_id),
+            "last_changed": entries[-1]["date_time"],
+        }
+        written += 1
+    days = list(history.day_counts())
+    most_edited = list(history.most_edited())
+    write(os.path.join(out, "days.json"), json.dumps(dict(days), indent=1))
+    write(
+        os.path.join(out, "most_edited.json"),
+        json.dumps(
+            [
+                {
+                    "article_id": article_id,
+                    "versions": versions,
+                    "title": manifest.get(article_id, dict()).get("title"),
+                    "slug": slug(article_id),
+                }
+                for article_id, versions in most_edited
+            ],
+            indent=1,
+        ),
+    )
+    write(os.path.join(out, "index.html"), index_page(days, most_edited, manifest))
+    write(manifest_path, json.dumps(manifest))
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NYTdiff archive")
+    parser.add_argument("--db", help="database URL, DATABASE_URL by default")
+    parser.add_argument(
+        "--sources",
+        metavar="FILE",
+        default=nytdiff.SOURCES_FILE,
+        help="JSON file of source definitions, SOURCES_FILE by default",
+    )
+    parser.add_argument(
+        "--source",
+        metavar="NAME",
+        default="nyt",
+        help="source whose versions are archived (default nyt)",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_cmd = commands.add_parser("build", help="build the static archive")
+    build_cmd.add_argument("--out", default="archive")
+    build_cmd.add_argument(
+        "--full", action="store_true", help="rewrite every article"
+    )
+    article_cmd = commands.add_parser("article", help="print an article's timeline")
+    article_cmd.add_argument("article_id")
+    commands.add_parser("stats", help="print changes per day and most edited")
+    args = parser.parse_args()
+
+    sources = dict(nytdiff.BUILTIN_SOURCES)
+    if args.sources:
+        sources.update(
+            (source.name, source) for source in nytdiff.load_sources(args.sources)
+        )
+    if args.source not in sources:
+        parser.error("unknown source: {}".format(args.source))
+    history = History(nytdiff.connect_db(args.db), sources[args.source])
+    if args.command == "build":
+        written = build(args.out, history, args.full)
+        print("Wrote {} articles to {}".format(written, args.out))
+    elif args.command == "article":
+        for article_id, versions in history.timelines([args.article_id]):
+            print(json.dumps(timeline(versions, history.source), indent=1))
+    else:
+        for day, changes in history.day_counts():
+            print("{} {:>6}".format(day, changes))
+        print()
+        for article_id, versions in history.most_edited(20):
+            print("{:>4} {}".format(versions, article_id))
+
+
+if __name__ == "__main__":
+    main()
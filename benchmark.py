@@ -0,0 +1,474 @@
+#!/usr/bin/python3
+"""
+Benchmarks for nytdiff.py
+
+    python benchmark.py diff --db titles.db --limit 5000
+    python benchmark.py replay snapshots/ --renderer pillow --json run.json
+    python benchmark.py replay snapshots/ --baseline run.json
+    python benchmark.py startup --budget 800
+
+replay feeds a directory of recorded Top Stories responses (the raw body
+of home.json, one file per poll, processed in name order) through
+NYTParser.parse_pages in a scratch directory, with stub Twitter and
+Bluesky clients, and reports the time spent in each stage.
+
+startup runs nytdiff.py's main() in a subprocess under -X importtime as
+a cron run that finds the feed unchanged, and fails if its imports take
+longer than the budget or it loads a module only needed to render or
+post.
+"""
+
+import argparse
+import collections
+import itertools
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+
+import dataset
+import requests
+import simplediff
+
+import nytdiff
+
+STAGES = ["fetch", "parse", "hash", "db", "diff", "render", "post"]
+
+# Only needed to render or post diffs, a run without any must not load them
+LAZY_MODULES = ["PIL", "atproto", "bleach", "selenium", "tweepy"]
+
+# A cron run whose feed answers 304 Not Modified, with every network
+# configured
+NO_CHANGE_RUN = """
+import json, sys, time
+start = time.perf_counter()
+import requests
+import nytdiff
+
+def unchanged(self, url, header=None, payload=None):
+    r = requests.Response()
+    r.status_code = 304
+    r.url = url
+    return r
+
+nytdiff.NYTParser.get_page = unchanged
+nytdiff.main([])
+json.dump(
+    {"seconds": time.perf_counter() - start, "modules": sorted(sys.modules)},
+    sys.stdout,
+)
+"""
+
+
+def version_pairs(db, limit):
+    # Consecutive versions of the same article, one (old, new) pair for
+    # every field that changed between them
+    fields = nytdiff.NYTParser.fingerprint_fields
+    previous = None
+    count = 0
+    query = "SELECT * FROM nyt_versions ORDER BY article_id, version"
+    for row in nytdiff.rebuild_versions(db.query(query), fields):
+        if previous is not None and previous["article_id"] == row["article_id"]:
+            for field in fields:
+                old, new = previous[field], row[field]
+                if not old or not new or old == new:
+                    continue
+                if field == "url":
+                    old = old.split("nytimes.com/")[-1]
+                    new = new.split("nytimes.com/")[-1]
+                yield field, old, new
+                count += 1
+                if count >= limit:
+                    return
+        previous = row
+
+
+def time_engine(func, pairs, repeat):
+    # Best of `repeat` runs over the whole corpus, in seconds
+    best = None
+    for x in range(repeat):
+        start = time.perf_counter()
+        for field, old, new in pairs:
+            func(old, new)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def bench_diff(args):
+    db = dataset.connect("sqlite:///" + args.db)
+    pairs = list(version_pairs(db, args.limit))
+    if not pairs:
+        print("No changed versions found in {}".format(args.db))
+        return
+    engines = [
+        ("simplediff", simplediff.html_diff),
+        ("myers word", lambda old, new: nytdiff.html_diff(old, new)),
+        ("myers char", lambda old, new: nytdiff.html_diff(old, new, "char")),
+    ]
+    print("{} pairs from {}".format(len(pairs), args.db))
+    for field in sorted(set(field for field, old, new in pairs)):
+        subset = [pair for pair in pairs if pair[0] == field]
+        print("\n{} ({} pairs)".format(field, len(subset)))
+        for name, func in engines:
+            elapsed = time_engine(func, subset, args.repeat)
+            print(
+                "  {:<12} {:>9.3f} ms total {:>9.1f} us/diff".format(
+                    name, elapsed * 1000, elapsed * 1e6 / len(subset)
+                )
+            )
+    same = sum(
+        1
+        for field, old, new in pairs
+        if simplediff.html_diff(old, new) == nytdiff.html_diff(old, new)
+    )
+    print("\nSame markup as simplediff for {} of {} pairs".format(same, len(pairs)))
+
+
+class StageTimer(object):
+    """
+    accumulates wall time per stage, from any thread
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = collections.defaultdict(float)
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.totals[stage] += seconds
+
+    def wrap(self, stage, func):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+
+        return timed
+
+
+class StubTwitterAPI(object):
+    def __init__(self, latency):
+        self.latency = latency
+
+    def media_upload(self, filename):
+        time.sleep(self.latency)
+        return types.SimpleNamespace(media_id_string="1")
+
+    def create_media_metadata(self, media_id, alt_text):
+        time.sleep(self.latency)
+
+
+class StubTwitterClient(object):
+    def __init__(self, latency):
+        self.latency = latency
+        self.ids = itertools.count(1)
+
+    def create_tweet(self, **kwargs):
+        time.sleep(self.latency)
+        return types.SimpleNamespace(data={"id": str(next(self.ids))})
+
+
+class StubBluesky(object):
+    def __init__(self, latency):
+        self.latency = latency
+        self.ids = itertools.count(1)
+
+    def upload_blob(self, data):
+        time.sleep(self.latency)
+        blob = nytdiff.models.blob_ref.BlobRef(
+            mime_type="image/png",
+            size=len(data),
+            ref=nytdiff.models.blob_ref.IpldLink(link="bafkrei{}".format(len(data))),
+        )
+        return types.SimpleNamespace(blob=blob)
+
+    def send_post(self, text="", **kwargs):
+        time.sleep(self.latency)
+        n = next(self.ids)
+        return types.SimpleNamespace(
+            uri="at://did:plc:replay/app.bsky.feed.post/{}".format(n),
+            cid="bafyreplay{}".format(n),
+        )
+
+
+class ReplayParser(nytdiff.NYTParser):
+    """
+    NYTParser that reads each poll from the next recorded snapshot
+    """
+
+    def __init__(self, snapshots, timer, **kwargs):
+        nytdiff.NYTParser.__init__(self, "replay", **kwargs)
+        # One section, polled on every call and as fast as it can be read
+        self.urls = self.urls[:1]
+        self.intervals = dict()
+        self.rate_limiter = nytdiff.RateLimiter(1, period=0)
+        self.snapshots = iter(snapshots)
+        self.timer = timer
+        self.articles_seen = 0
+        self.get_page = timer.wrap("fetch", self.get_page)
+        self.fetch_section = timer.wrap("fetch_section", self.fetch_section)
+        self.feed_state = timer.wrap("feed_db", self.feed_state)
+        self.touch_feed = timer.wrap("feed_db", self.touch_feed)
+        self.json_to_dict = timer.wrap("hash", self.json_to_dict)
+        self.store_data = timer.wrap("db", self.store_data)
+        self.lookup_versions = timer.wrap("db", self.lookup_versions)
+        self.post_rendered = timer.wrap("post", self.post_rendered)
+        self.renderer.render = timer.wrap("render", self.renderer.render)
+
+    def get_page(self, url, header=None, payload=None):
+        r = requests.Response()
+        r.status_code = 200
+        r.url = url
+        with open(next(self.snapshots), "rb") as f:
+            r._content = f.read()
+        return r
+
+    def loop_data(self, data):
+        self.articles_seen += len(data.get("results", list()))
+        return nytdiff.NYTParser.loop_data(self, data)
+
+    def fetch_thumbnail(self, url):
+        # Recorded thumbnails would be downloaded from the NYT
+        return ("thumbnail " + url).encode("utf8")
+
+
+def replay(snapshots, renderer, latency):
+    timer = StageTimer()
+    nytdiff.html_diff = timer.wrap("diff", nytdiff.html_diff)
+    # Stage timers only see worker threads, not worker processes
+    nytdiff.RENDER_EXECUTOR = "thread"
+    nytdiff.TESTING = False
+    # The scratch directory's database, whatever DATABASE_URL says
+    nytdiff.DATABASE_URL = "sqlite:///titles.db"
+    parser = ReplayParser(
+        snapshots,
+        timer,
+        api=StubTwitterAPI(latency),
+        client=StubTwitterClient(latency),
+        bsky_api=StubBluesky(latency),
+        renderer=nytdiff.get_renderer(renderer),
+    )
+    start = time.perf_counter()
+    try:
+        for x in snapshots:
+            parser.parse_pages()
+            parser.drain_outbox()
+    finally:
+        parser.renderer.shutdown()
+    elapsed = time.perf_counter() - start
+    stages = dict(timer.totals)
+    # fetch_section covers reading the snapshot, the feed bookkeeping
+    # and json.loads
+    feed_db = stages.pop("feed_db", 0)
+    stages["parse"] = stages.pop("fetch_section", 0) - stages.get("fetch", 0) - feed_db
+    stages["db"] = stages.get("db", 0) + feed_db
+    return {
+        "snapshots": len(snapshots),
+        "articles": parser.articles_seen,
+        "diffs": parser.outbox_table.count() if parser.outbox_table.exists else 0,
+        "seconds": elapsed,
+        "stages": dict((stage, stages.get(stage, 0)) for stage in STAGES),
+    }
+
+
+def bench_replay(args):
+    snapshots = sorted(
+        os.path.join(args.snapshots, name)
+        for name in os.listdir(args.snapshots)
+        if name.endswith(".json")
+    )
+    if not snapshots:
+        print("No .json snapshots in {}".format(args.snapshots))
+        return
+    here = os.path.dirname(os.path.abspath(nytdiff.__file__))
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="nytdiff-replay-") as workdir:
+        for d in ["css", "fonts", "img"]:
+            os.symlink(os.path.join(here, d), os.path.join(workdir, d))
+        os.mkdir(os.path.join(workdir, "output"))
+        if args.db:
+            shutil.copy(args.db, os.path.join(workdir, "titles.db"))
+        os.chdir(workdir)
+        if args.tracemalloc:
+            tracemalloc.start()
+        try:
+            result = replay(snapshots, args.renderer, args.post_latency / 1000)
+        finally:
+            os.chdir(cwd)
+        if args.tracemalloc:
+            result["peak_traced_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result["peak_rss_mb"] = maxrss / (2**20 if sys.platform == "darwin" else 2**10)
+    result["renderer"] = args.renderer
+    result["articles_per_second"] = result["articles"] / result["seconds"]
+    print_replay(result, load_baseline(args.baseline))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+def load_baseline(path):
+    if not path:
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def print_replay(result, baseline=None):
+    def change(value, old):
+        if not old:
+            return ""
+        return " ({:+.1f}%)".format((value - old) * 100 / old)
+
+    print(
+        "{snapshots} snapshots, {articles} articles, {diffs} diffs, "
+        "renderer {renderer}".format(**result)
+    )
+    for stage in STAGES:
+        value = result["stages"][stage]
+        old = baseline["stages"].get(stage) if baseline else None
+        print("  {:<8} {:>10.1f} ms{}".format(stage, value * 1000, change(value, old)))
+    for key, label in [
+        ("seconds", "total s"),
+        ("articles_per_second", "articles/s"),
+        ("peak_traced_mb", "peak py MB"),
+        ("peak_rss_mb", "peak rss MB"),
+    ]:
+        if key not in result:
+            continue
+        old = baseline.get(key) if baseline else None
+        value = result[key]
+        print("  {:<12} {:>10.2f}{}".format(label, value, change(value, old)))
+
+
+def import_times(stderr):
+    # (module, microseconds) of each top level import in -X importtime
+    # output, including what it imported in turn
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        own, cumulative, name = line[len("import time:") :].split("|")
+        if cumulative.strip().isdigit() and not name.startswith("  "):
+            yield name.strip(), int(cumulative)
+
+
+def no_change_run(workdir):
+    here = os.path.dirname(os.path.abspath(nytdiff.__file__))
+    env = dict(
+        os.environ,
+        PYTHONPATH=here,
+        TESTING="True",
+        LOG_FOLDER="",
+        DATABASE_URL="sqlite:///titles.db",
+        METRICS_FILE="",
+        METRICS_PORT="0",
+        NYT_API_KEY="startup",
+        BLUESKY_LOGIN="startup",
+        BLUESKY_PASSWD="startup",
+    )
+    for name in [
+        "NYT_TWITTER_CONSUMER_KEY",
+        "NYT_TWITTER_CONSUMER_SECRET",
+        "NYT_TWITTER_ACCESS_TOKEN",
+        "NYT_TWITTER_ACCESS_TOKEN_SECRET",
+        "NYT_BEARER_TOKEN",
+    ]:
+        env[name] = "startup"
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", NO_CHANGE_RUN],
+        cwd=workdir,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        sys.exit("No-change run failed:\n" + proc.stderr[-2000:])
+    result = json.loads(proc.stdout)
+    result["imports"] = sorted(import_times(proc.stderr), key=lambda i: -i[1])
+    result["import_ms"] = sum(us for name, us in result["imports"]) / 1000
+    return result
+
+
+def bench_startup(args):
+    # Best of args.repeat runs, each against the same scratch database
+    with tempfile.TemporaryDirectory(prefix="nytdiff-startup-") as workdir:
+        runs = [no_change_run(workdir) for x in range(args.repeat)]
+    best = min(runs, key=lambda run: run["import_ms"])
+    print(
+        "No-change run: {:.0f} ms of imports, {:.0f} ms in total".format(
+            best["import_ms"], best["seconds"] * 1000
+        )
+    )
+    for name, us in best["imports"][:8]:
+        print("  {:<24} {:>8.1f} ms".format(name, us / 1000))
+    failed = False
+    loaded = sorted(
+        set(name.split(".")[0] for name in best["modules"]) & set(LAZY_MODULES)
+    )
+    if loaded:
+        print("Loaded without a diff to render or post: {}".format(", ".join(loaded)))
+        failed = True
+    if best["import_ms"] > args.budget:
+        print("Over the budget of {} ms".format(args.budget))
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="nytdiff.py benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+    diff = commands.add_parser(
+        "diff", help="compare the diff engine with simplediff on stored versions"
+    )
+    diff.add_argument("--db", default="titles.db")
+    diff.add_argument("--limit", type=int, default=5000)
+    diff.add_argument("--repeat", type=int, default=3)
+    diff.set_defaults(func=bench_diff)
+    replay = commands.add_parser(
+        "replay", help="replay recorded feed snapshots through NYTParser"
+    )
+    replay.add_argument("snapshots", help="directory of recorded home.json bodies")
+    replay.add_argument("--renderer", default=nytdiff.RENDERER)
+    replay.add_argument("--db", help="titles.db to start from, it is copied")
+    replay.add_argument(
+        "--post-latency",
+        type=float,
+        default=0,
+        help="milliseconds each stub Twitter/Bluesky call takes",
+    )
+    replay.add_argument(
+        "--tracemalloc",
+        action="store_true",
+        help="also report peak Python allocations, this slows every stage down",
+    )
+    replay.add_argument("--json", help="write the results to this file")
+    replay.add_argument("--baseline", help="results of an earlier --json run")
+    replay.set_defaults(func=bench_replay)
+    startup = commands.add_parser(
+        "startup", help="check the import time of a run without changes"
+    )
+    startup.add_argument(
+        "--budget", type=float, default=800, help="milliseconds, 800 by default"
+    )
+    startup.add_argument("--repeat", type=int, default=3)
+    startup.set_defaults(func=bench_startup)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import nytdiff  # noqa: E402
+
+SOURCE = nytdiff.Source(
+    name="test",
+    urls=["http://feed.test/items.json"],
+    fields={
+        "article_id": "id",
+        "url": "url",
+        "title": "title",
+        "abstract": "abstract",
+        "byline": "byline",
+    },
+    extra=("byline",),
+    twitter_env="TEST",
+    bluesky_env="TEST_BLUESKY",
+)
+
+
+class StubRenderer(nytdiff.DiffRenderer):
+    """
+    draws a blank image for every diff, or raises if failing is set
+    """
+
+    version = "stub-1"
+
+    def __init__(self):
+        self.failing = False
+        self.renders = 0
+
+    def render(self, diff_html, filename):
+        if self.failing:
+            raise RuntimeError("renderer crashed")
+        self.renders += 1
+        nytdiff.Image.new("RGB", (60, 20), "white").save(filename)
+        return (60, 20)
+
+
+def item(n, title, abstract="Abstract", byline=None):
+    return {
+        "id": "a{}".format(n),
+        "url": "https://example.org/{}".format(n),
+        "title": title,
+        "abstract": abstract,
+        "byline": byline,
+    }
+
+
+def poll(parser, *articles):
+    # Stores the articles as one poll of the feed would
+    return parser.detect_changes(list(articles))
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    # Every test runs in a directory of its own, with its own database
+    # and image folders
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("output")
+    monkeypatch.setattr(nytdiff, "DATABASE_URL", "sqlite:///titles.db")
+    monkeypatch.setattr(nytdiff, "THUMBNAIL_FOLDER", str(tmp_path / "thumbnails"))
+    return tmp_path
+
+
+@pytest.fixture
+def renderer():
+    return StubRenderer()
+
+
+@pytest.fixture
+def parser(renderer):
+    # A parser with no accounts to post to
+    parser = nytdiff.BaseParser(None, None, renderer=renderer, source=SOURCE)
+    yield parser
+    parser.db.close()
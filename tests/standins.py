@@ -0,0 +1,223 @@
+"""
+Local stand-ins for the Twitter and atproto endpoints nytdiff posts to,
+so the publishing stage runs against real clients without the network
+
+    with TwitterStandIn() as twitter, BlueskyStandIn() as bluesky:
+        # point TWITTER_API_HOST at twitter.url and BLUESKY_BASE_URL at
+        # bluesky.url, then post
+
+Each keeps the requests it answered in calls, answers the next ones for
+a path with the errors queued by fail(), and takes latency seconds per
+request while counting in max_in_flight how many it served at once.
+"""
+
+import base64
+import collections
+import http.server
+import json
+import threading
+import time
+
+Call = collections.namedtuple("Call", "path headers body json")
+
+DID = "did:plc:standin"
+CID = "bafyreie5737gdxlw5i64vzichcalba3z2v5n6icifvx5xytvske7mr3hpm"
+BLOB_CID = "bafkreibme22gw2h7y2h7tg2fhqotaqjucnbc24deqo72b6mkl2egezxhvy"
+
+
+class StandIn(object):
+    """
+    an HTTP server on a free local port, answering from routes: path ->
+    function of the Call returning (status, headers, body)
+    """
+
+    def __init__(self):
+        self.calls = list()
+        self.errors = collections.defaultdict(collections.deque)
+        self.latency = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.server.standin = self
+        self.url = "http://127.0.0.1:{}".format(self.server.server_address[1])
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def fail(self, path, status, headers=None, times=1, after=0):
+        # After the next `after` requests to path, `times` requests get
+        # status instead of an answer
+        for x in range(after):
+            self.errors[path].append(None)
+        for x in range(times):
+            self.errors[path].append((status, headers or dict()))
+
+    def called(self, path):
+        return [call for call in self.calls if call.path == path]
+
+    def handle(self, call):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.latency)
+            with self.lock:
+                error = None
+                if self.errors[call.path]:
+                    error = self.errors[call.path].popleft()
+                if error is not None:
+                    status, headers = error
+                    return status, headers, self.error_body(status)
+                self.calls.append(call)
+            route = self.routes.get(call.path)
+            if route is None:
+                return 404, dict(), self.error_body(404)
+            return route(call)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def error_body(self, status):
+        return {"error": "StandInError", "message": "status {}".format(status)}
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.answer()
+
+    def do_POST(self):
+        self.answer()
+
+    def answer(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        data = None
+        if "json" in (self.headers.get("Content-Type") or ""):
+            data = json.loads(body)
+        call = Call(self.path.split("?")[0], dict(self.headers), body, data)
+        status, headers, content = self.server.standin.handle(call)
+        content = json.dumps(content).encode("utf8") if content is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TwitterStandIn(StandIn):
+    """
+    the v1.1 media upload and v2 tweet endpoints, on one host for both
+    api.twitter.com and upload.twitter.com
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.ids = iter(range(1000, 10**9))
+        # (id, text, id replied to, media ids) of the tweets posted, in
+        # order, and media id -> alt text
+        self.tweets = list()
+        self.alt_texts = dict()
+        self.routes = {
+            "/1.1/media/upload.json": self.media_upload,
+            "/1.1/media/metadata/create.json": self.media_metadata,
+            "/2/tweets": self.create_tweet,
+        }
+
+    def error_body(self, status):
+        return {"errors": [{"message": "status {}".format(status), "code": status}]}
+
+    def media_upload(self, call):
+        with self.lock:
+            media_id = next(self.ids)
+        return 200, dict(), {"media_id": media_id, "media_id_string": str(media_id)}
+
+    def media_metadata(self, call):
+        with self.lock:
+            self.alt_texts[call.json["media_id"]] = call.json["alt_text"]["text"]
+        return 200, dict(), None
+
+    def create_tweet(self, call):
+        reply = call.json.get("reply") or dict()
+        media = call.json.get("media") or dict()
+        with self.lock:
+            tweet_id = str(next(self.ids))
+            self.tweets.append(
+                (
+                    tweet_id,
+                    call.json["text"],
+                    reply.get("in_reply_to_tweet_id"),
+                    media.get("media_ids", []),
+                )
+            )
+        return 201, dict(), {"data": {"id": tweet_id, "text": call.json["text"]}}
+
+
+def fake_jwt(**claims):
+    def part(data):
+        encoded = base64.urlsafe_b64encode(json.dumps(data).encode("utf8"))
+        return encoded.rstrip(b"=").decode("ascii")
+
+    return ".".join([part({"alg": "none", "typ": "JWT"}), part(claims), "sig"])
+
+
+class BlueskyStandIn(StandIn):
+    """
+    a PDS serving the session, profile, blob upload and record creation
+    calls of atproto.Client
+    """
+
+    def __init__(self):
+        super().__init__()
+        # (uri, record) of the posts created, in order
+        self.records = list()
+        self.routes = {
+            "/xrpc/com.atproto.server.createSession": self.create_session,
+            "/xrpc/app.bsky.actor.getProfile": self.get_profile,
+            "/xrpc/com.atproto.repo.uploadBlob": self.upload_blob,
+            "/xrpc/com.atproto.repo.createRecord": self.create_record,
+        }
+
+    def create_session(self, call):
+        expires = int(time.time()) + 3600
+        return (
+            200,
+            dict(),
+            {
+                "accessJwt": fake_jwt(sub=DID, exp=expires, scope="com.atproto.access"),
+                "refreshJwt": fake_jwt(
+                    sub=DID, exp=expires, scope="com.atproto.refresh"
+                ),
+                "handle": call.json["identifier"],
+                "did": DID,
+            },
+        )
+
+    def get_profile(self, call):
+        return 200, dict(), {"did": DID, "handle": "standin.test"}
+
+    def upload_blob(self, call):
+        blob = {
+            "$type": "blob",
+            "ref": {"$link": BLOB_CID},
+            "mimeType": call.headers.get("Content-Type", "*/*"),
+            "size": len(call.body),
+        }
+        return 200, dict(), {"blob": blob}
+
+    def create_record(self, call):
+        with self.lock:
+            uri = "at://{}/app.bsky.feed.post/{}".format(DID, len(self.records) + 1)
+            self.records.append((uri, call.json["record"]))
+        return 200, dict(), {"uri": uri, "cid": CID}
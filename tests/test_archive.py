@@ -0,0 +1,31 @@
+import json
+import os
+
+import archive
+import nytdiff
+from conftest import SOURCE, item, poll
+
+
+def test_build_for_a_source(parser, tmp_path):
+    poll(parser, item(1, "Old title", byline="Jo"))
+    moved = item(1, "New title", byline="Jo")
+    moved["url"] = "https://example.org/politics/1"
+    poll(parser, moved)
+    history = archive.History(parser.db, SOURCE)
+    out = str(tmp_path / "archive")
+    assert archive.build(out, history) == 1
+
+    name = os.path.join(out, "articles", archive.slug("a1"))
+    with open(name + ".json") as f:
+        entries = json.load(f)["versions"]
+    assert [entry["byline"] for entry in entries] == ["Jo", "Jo"]
+    changes = entries[1]["changes"]
+    assert changes["title"] == "<del>Old</del> <ins>New</ins> title"
+    # Only the path of a URL is diffed
+    assert changes["url"] == nytdiff.html_diff(
+        "1", "politics/1", nytdiff.URL_DIFF_GRANULARITY
+    )
+    with open(name + ".html") as f:
+        assert "<b>Change in Headline</b>" in f.read()
+    # Nothing changed since
+    assert archive.build(out, history) == 0
@@ -0,0 +1,81 @@
+import sqlite3
+
+import nytdiff
+from conftest import item, poll
+
+
+def feed(parser, monkeypatch, *articles):
+    # The next polls fetch articles
+    fetched = {"http://feed.test/items.json": (None, {"results": list(articles)})}
+    monkeypatch.setattr(parser, "fetch_sections", lambda: fetched)
+
+
+def test_failed_poll_is_not_remembered(parser, monkeypatch):
+    saved = list()
+
+    def save_feed_state(url, r, article_ids):
+        if not saved:
+            saved.append(url)
+            raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(parser, "save_feed_state", save_feed_state)
+    monkeypatch.setattr(parser, "feed_ids", lambda urls: {"a1"})
+    feed(parser, monkeypatch, item(1, "Old"))
+    # Stored before the run's feed states, and rolled back with them
+    nytdiff.run_poll(parser, "poll")
+    assert parser.versions_table.count() == 0
+    assert not parser.warm
+
+    nytdiff.run_poll(parser, "poll")
+    assert parser.warm
+    assert parser.versions_table.count() == 1
+    assert parser.known["a1"]["version"] == 1
+
+    feed(parser, monkeypatch, item(1, "New"))
+    nytdiff.run_poll(parser, "poll")
+    assert parser.versions_table.count() == 2
+    assert [row["new"] for row in parser.outbox_table.all()] == ["New"]
+
+
+def test_changes_rolled_back_are_found_again(parser, monkeypatch):
+    locked = list()
+
+    def remove_old(column):
+        if locked:
+            raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(parser, "save_feed_state", lambda url, r, ids: None)
+    monkeypatch.setattr(parser, "feed_ids", lambda urls: {"a1"})
+    monkeypatch.setattr(parser, "remove_old", remove_old)
+    feed(parser, monkeypatch, item(1, "Old"))
+    nytdiff.run_poll(parser, "poll")
+
+    locked.append(True)
+    feed(parser, monkeypatch, item(1, "New"))
+    nytdiff.run_poll(parser, "poll")
+    assert parser.versions_table.count() == 1
+    assert parser.outbox_table.count() == 0
+
+    locked.clear()
+    nytdiff.run_poll(parser, "poll")
+    assert parser.versions_table.count() == 2
+    assert [row["new"] for row in parser.outbox_table.all()] == ["New"]
+
+
+def test_failed_article_is_undone(parser, monkeypatch):
+    poll(parser, item(1, "Old"))
+    queue_diff = parser.queue_diff
+
+    def fail(*args):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    # a1's new version is stored, then queueing its diff fails
+    monkeypatch.setattr(parser, "queue_diff", fail)
+    assert not poll(parser, item(1, "New"), item(2, "Other"))
+    assert [row["article_id"] for row in parser.versions_table] == ["a1", "a2"]
+    assert parser.known["a1"]["version"] == 1
+
+    monkeypatch.setattr(parser, "queue_diff", queue_diff)
+    assert poll(parser, item(1, "New"), item(2, "Other"))
+    assert parser.versions_table.count(article_id="a1") == 2
+    assert [row["new"] for row in parser.outbox_table.all()] == ["New"]
@@ -0,0 +1,105 @@
+import os
+import random
+import re
+
+import pytest
+
+import nytdiff
+
+
+def lcs(a, b):
+    # Length of the longest common subsequence, by dynamic programming
+    row = [0] * (len(b) + 1)
+    for x in a:
+        previous = 0
+        for j, y in enumerate(b):
+            current = row[j + 1]
+            row[j + 1] = previous + 1 if x == y else max(row[j + 1], row[j])
+            previous = current
+    return row[-1]
+
+
+def sides(ops):
+    old = [token for op, tokens in ops if op != "+" for token in tokens]
+    new = [token for op, tokens in ops if op != "-" for token in tokens]
+    return old, new
+
+
+@pytest.mark.parametrize(
+    "old, new, expected",
+    [
+        ("a b c", "a b c", [("=", ["a", "b", "c"])]),
+        ("", "", []),
+        ("", "a", [("+", ["a"])]),
+        ("a b", "c d", [("-", ["a", "b"]), ("+", ["c", "d"])]),
+        ("a b c", "a x c", [("=", ["a"]), ("-", ["b"]), ("+", ["x"]), ("=", ["c"])]),
+        ("a b c d", "a d", [("=", ["a"]), ("-", ["b", "c"]), ("=", ["d"])]),
+        ("a d", "a b c d", [("=", ["a"]), ("+", ["b", "c"]), ("=", ["d"])]),
+    ],
+)
+def test_diff_runs(old, new, expected):
+    assert nytdiff.diff(old.split(), new.split()) == expected
+
+
+def test_diff_is_minimal():
+    rnd = random.Random(12)
+    for x in range(500):
+        old = [rnd.choice("abcde") for y in range(rnd.randint(0, 14))]
+        new = [rnd.choice("abcde") for y in range(rnd.randint(0, 14))]
+        ops = nytdiff.diff(old, new)
+        assert sides(ops) == (old, new)
+        changed = sum(len(tokens) for op, tokens in ops if op != "=")
+        assert changed == len(old) + len(new) - 2 * lcs(old, new)
+        # Runs alternate, and deletions come before their insertions
+        for (op1, t1), (op2, t2) in zip(ops, ops[1:]):
+            assert op1 != op2
+            assert (op1, op2) != ("+", "-")
+
+
+def test_html_diff():
+    assert (
+        nytdiff.html_diff("Senate passes the bill", "House passes the bill")
+        == "<del>Senate</del> <ins>House</ins> passes the bill"
+    )
+    assert nytdiff.html_diff("same words", "same words") == "same words"
+    assert (
+        nytdiff.html_diff("2024/01/02/us/old-slug", "2024/01/02/us/new-slug", "char")
+        == "2024/01/02/us/<del>old</del><ins>new</ins>-slug"
+    )
+
+
+@pytest.fixture
+def pillow():
+    renderer = nytdiff.PillowRenderer()
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    renderer.FONT = os.path.join(repo, renderer.FONT)
+    return renderer
+
+
+def line_texts(lines):
+    return ["".join(text for x, text, style, width in line) for line in lines]
+
+
+def test_lines_break_at_whitespace(pillow):
+    # A slug that fits on a line is never broken between its pieces
+    old = "us/politics/short-slug"
+    new = "us/politics/much-longer-slug"
+    words = "Senators passed the spending bill late on Tuesday night after".split()
+    for n in range(len(words)):
+        prefix = " ".join(words[:n])
+        diff = prefix + " " + nytdiff.html_diff(old, new, "char")
+        lines = pillow.layout(diff)
+        plain = re.sub("</?(?:ins|del)>", "", diff).strip()
+        assert " ".join(line_texts(lines)) == plain
+
+
+def test_word_wider_than_a_line_is_split(pillow):
+    slug = "-".join(["slug"] * 40)
+    diff = "A <del>{}</del><ins>x{}</ins>".format(slug, slug)
+    lines = pillow.layout(diff)
+    assert len(lines) > 2
+    assert line_texts(lines)[0] == "A"
+    assert "".join(line_texts(lines[1:])) == slug + "x" + slug
+    for line in lines:
+        x, text, style, width = line[-1]
+        assert x + width <= pillow.WIDTH * pillow.SCALE
@@ -0,0 +1,129 @@
+import gzip
+import io
+import json
+from datetime import datetime
+
+import pytest
+
+import nytdiff
+from conftest import SOURCE, item, poll
+
+DATED = nytdiff.Source(
+    name="test",
+    urls=SOURCE.urls,
+    fields=SOURCE.fields,
+    extra=SOURCE.extra,
+    date_fields=("updated",),
+)
+
+
+def dated(n, title, updated):
+    article = item(n, title)
+    article["updated"] = updated
+    return article
+
+
+@pytest.fixture
+def ingester(renderer):
+    parser = nytdiff.BaseParser(None, None, renderer=renderer, source=DATED)
+    yield parser
+    parser.db.close()
+
+
+def write_json(path, payload):
+    with open(path, "w") as f:
+        json.dump(payload, f)
+    return str(path)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 64 * 1024])
+def test_stream_across_chunks(chunk_size):
+    docs = [
+        {"id": 1, "title": "A \"quoted\" title", "tags": [["a", "b"], {"c": []}]},
+        1234567,
+        {"id": 3, "title": "Ünïcode"},
+    ]
+    document = json.dumps(
+        {"status": "OK", "meta": {"hits": [1, 2]}, "response": {"docs": docs}},
+        indent=1,
+    )
+    stream = nytdiff.JSONStream(io.StringIO(document), chunk_size=chunk_size)
+    assert list(stream.articles()) == docs
+
+
+def test_stream_top_level_array():
+    document = ' [ {"id": 1} , {"id": 2} ] '
+    stream = nytdiff.JSONStream(io.StringIO(document), chunk_size=4)
+    assert list(stream.articles()) == [{"id": 1}, {"id": 2}]
+
+
+def test_stream_stops_at_a_broken_value():
+    stream = nytdiff.JSONStream(
+        io.StringIO('{"results": [{"id": 1}, {"id": "' + "x" * 100),
+        chunk_size=8,
+        max_value=32,
+    )
+    articles = stream.articles()
+    assert next(articles) == {"id": 1}
+    with pytest.raises(ValueError):
+        next(articles)
+
+
+def test_bad_lines_are_skipped(tmp_path):
+    lines = [
+        json.dumps({"results": [{"id": 1}, {"id": 2}]}),
+        "{not json",
+        "",
+        json.dumps({"id": 3}),
+    ]
+    path = tmp_path / "feed.jsonl.gz"
+    with gzip.open(path, "wt", encoding="utf8") as f:
+        f.write("\n".join(lines))
+    articles = list(nytdiff.read_articles(str(path)))
+    assert articles == [{"id": 1}, {"id": 2}, {"id": 3}]
+
+
+def test_ingest_continues_from_checkpoint(ingester, tmp_path):
+    articles = [
+        dated(n, "T", "2024-01-0{}T12:00:00+00:00".format(n)) for n in range(1, 6)
+    ]
+    path = write_json(tmp_path / "dump.json", {"results": articles})
+    checkpoint = str(tmp_path / "checkpoint.json")
+    nytdiff.save_checkpoint(checkpoint, {path: {"articles": 3, "done": False}})
+
+    assert ingester.ingest([path], checkpoint, batch=1) == (2, 0)
+    assert sorted(row["article_id"] for row in ingester.articles_table) == ["a4", "a5"]
+    assert nytdiff.load_checkpoint(checkpoint) == {path: {"articles": 5, "done": True}}
+    # A finished file isn't read again
+    assert ingester.ingest([path], checkpoint) == (0, 0)
+
+
+def test_backfilled_articles_are_archived(ingester, tmp_path):
+    path = write_json(
+        tmp_path / "dump.json",
+        {
+            "results": [
+                dated(1, "T0", "2024-01-02T15:00:00Z"),
+                dated(2, "U0", "Tue, 02 Jan 2024 16:00:00 +0100"),
+                dated(3, "V0", "2024-01-02T17:00:00"),
+            ]
+        },
+    )
+    assert ingester.ingest([path]) == (3, 0)
+    expected = {
+        "a1": datetime(2024, 1, 2, 12, 0),
+        "a2": datetime(2024, 1, 2, 12, 0),
+        "a3": datetime(2024, 1, 2, 14, 0),
+    }
+    for article_id, when in expected.items():
+        stored = ingester.read_version(article_id)["date_time"]
+        assert stored.replace(tzinfo=None) == when
+    assert {row["status"] for row in ingester.articles_table} == {"archived"}
+    assert len(ingester.outbox_table) == 0
+
+    # The next poll lists one of them, the others stay archived
+    ingester.current_ids = set()
+    poll(ingester, item(1, "T0"))
+    ingester.remove_old()
+    statuses = {row["article_id"]: row["status"] for row in ingester.articles_table}
+    assert statuses == {"a1": "home", "a2": "archived", "a3": "archived"}
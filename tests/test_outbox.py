@@ -0,0 +1,151 @@
+import os
+import threading
+import time
+
+import pytest
+
+import nytdiff
+from conftest import SOURCE, item, poll
+
+
+def statuses(parser):
+    return [(row["status"], row["attempts"]) for row in parser.outbox_table.all()]
+
+
+def queue_change(parser, old="Old", new="New"):
+    poll(parser, item(1, old))
+    poll(parser, item(1, new))
+
+
+def test_drain_sends_and_caches(parser, renderer):
+    queue_change(parser)
+    assert statuses(parser) == [("pending", 0)]
+    assert parser.drain_outbox() == 1
+    assert statuses(parser) == [("sent", 0)]
+    assert parser.images.get(parser.diff_filename("Old", "New"))
+    # The same change on another article reuses the image
+    poll(parser, item(2, "Old"))
+    poll(parser, item(2, "New"))
+    parser.drain_outbox()
+    assert renderer.renders == 1
+
+
+def test_images_are_named_by_the_renderer_drawing_them(parser, renderer):
+    # Source workers queue diffs without the configured renderer
+    worker = nytdiff.BaseParser(
+        None, None, renderer=nytdiff.DiffRenderer(), source=SOURCE
+    )
+    poll(worker, item(1, "Old"))
+    poll(worker, item(1, "New"))
+    worker.db.close()
+    parser.drain_outbox()
+    assert parser.images.get(parser.diff_filename("Old", "New"))
+    renderer.version = "stub-2"
+    assert not parser.images.get(parser.diff_filename("Old", "New"))
+
+
+def test_thumbnail_folder_is_created_when_needed(parser):
+    queue_change(parser)
+    parser.drain_outbox()
+    assert not os.path.exists(nytdiff.THUMBNAIL_FOLDER)
+    parser.thumbnails.get("missing")
+    assert os.path.isdir(nytdiff.THUMBNAIL_FOLDER)
+
+
+def test_collect_only_deletes_images():
+    names = ["a.png", "b.webp", "a.1000000.jpg", ".gitignore", "notes.txt"]
+    old = time.time() - 3600
+    for name in names:
+        with open(os.path.join("output", name), "w") as f:
+            f.write("x")
+        os.utime(os.path.join("output", name), (old, old))
+    images = nytdiff.ImageCache(suffix=".png")
+    assert images.collect(60) == 3
+    assert sorted(os.listdir("output")) == [".gitignore", "notes.txt"]
+
+
+def test_failed_render_is_retried(parser, renderer, monkeypatch):
+    monkeypatch.setattr(nytdiff, "RETRY_DELAY", 0)
+    queue_change(parser)
+    renderer.failing = True
+    parser.drain_outbox()
+    assert statuses(parser) == [("pending", 1)]
+
+    renderer.failing = False
+    parser.drain_outbox()
+    assert statuses(parser) == [("sent", 1)]
+
+
+def test_browser_crashes_are_raised(monkeypatch):
+    # A second crash in a row reaches render_queued, which retries the job
+    class CrashingBrowser(object):
+        uses = 0
+
+        def screenshot(self, page, diff_html, filename):
+            raise nytdiff.selenium_exceptions.WebDriverException("crashed")
+
+        def quit(self):
+            pass
+
+    monkeypatch.setattr(nytdiff, "PooledBrowser", CrashingBrowser)
+    pool = nytdiff.RenderPool(size=1)
+    with pytest.raises(nytdiff.selenium_exceptions.WebDriverException):
+        pool.screenshot("file:///diff.html", "<ins>New</ins>", "diff.png")
+
+
+def test_diff_without_changes_is_skipped(parser):
+    data = dict(article_id="a1", url="https://example.org/1", version=2)
+    parser.queue_diff("Same", "Same", "Change in Headline", data)
+    parser.drain_outbox()
+    assert statuses(parser) == [("skipped", 0)]
+
+
+def test_a_row_is_claimed_once(parser, renderer):
+    queue_change(parser)
+    other = nytdiff.BaseParser(None, None, renderer=renderer, source=SOURCE)
+    # Both consumers read the row before either marks it as theirs
+    find = parser.outbox_table.find
+    claimed = list()
+
+    def find_then_race(*args, **kwargs):
+        rows = list(find(*args, **kwargs))
+        claimed.extend(other.claim_outbox())
+        return rows
+
+    parser.outbox_table.find = find_then_race
+    assert parser.claim_outbox() == []
+    assert len(claimed) == 1
+    other.db.close()
+
+
+def test_claims_are_renewed_while_held(parser, renderer, monkeypatch):
+    monkeypatch.setattr(nytdiff, "OUTBOX_LEASE", 0.3)
+    queue_change(parser)
+    other = nytdiff.BaseParser(None, None, renderer=renderer, source=SOURCE)
+    jobs = parser.claim_outbox()
+    assert len(jobs) == 1
+    with parser.holding(jobs):
+        time.sleep(0.45)
+        assert other.claim_outbox() == []
+    # Once the holder stops renewing, the lease runs out
+    time.sleep(0.35)
+    assert len(other.claim_outbox()) == 1
+    other.db.close()
+
+
+def test_media_locks_are_dropped_once_unused(parser):
+    order = list()
+
+    def upload(name):
+        with parser.media_lock("bsky", "image"):
+            order.append(name)
+
+    with parser.media_lock("bsky", "image"):
+        thread = threading.Thread(target=upload, args=("second",))
+        thread.start()
+        time.sleep(0.05)
+        order.append("first")
+        assert len(parser.media_locks) == 1
+    thread.join()
+    assert order == ["first", "second"]
+    assert parser.media_locks == {}
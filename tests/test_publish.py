@@ -0,0 +1,164 @@
+import time
+
+import pytest
+
+import nytdiff
+from conftest import SOURCE, item, poll
+from standins import BlueskyStandIn, TwitterStandIn
+
+
+@pytest.fixture
+def networks(monkeypatch):
+    with TwitterStandIn() as twitter, BlueskyStandIn() as bluesky:
+        monkeypatch.setattr(nytdiff, "TESTING", False)
+        monkeypatch.setattr(nytdiff, "TWITTER_API_HOST", twitter.url)
+        monkeypatch.setattr(nytdiff, "BLUESKY_BASE_URL", bluesky.url)
+        for name in (
+            "CONSUMER_KEY",
+            "CONSUMER_SECRET",
+            "ACCESS_TOKEN",
+            "ACCESS_TOKEN_SECRET",
+        ):
+            monkeypatch.setenv("TEST_TWITTER_" + name, "x")
+        monkeypatch.setenv("TEST_BEARER_TOKEN", "x")
+        monkeypatch.setenv("TEST_BLUESKY_LOGIN", "test.standin")
+        monkeypatch.setenv("TEST_BLUESKY_PASSWD", "x")
+        yield twitter, bluesky
+
+
+@pytest.fixture
+def poster(networks, renderer):
+    parser = nytdiff.source_parser(SOURCE, renderer)
+    yield parser
+    parser.db.close()
+
+
+def titles(n, *titles):
+    return [item(n, title) for title in titles]
+
+
+def tweet_threads(twitter):
+    # url -> alt texts of the replies, following each thread from its root
+    replies = dict()
+    for tweet_id, text, reply_to, media_ids in twitter.tweets:
+        replies.setdefault(reply_to, list()).append((tweet_id, media_ids))
+    threads = dict()
+    for tweet_id, text, reply_to, media_ids in twitter.tweets:
+        if reply_to is not None:
+            continue
+        thread = list()
+        parent = tweet_id
+        while parent in replies:
+            assert len(replies[parent]) == 1, "thread forked"
+            parent, media_ids = replies[parent][0]
+            thread.append(twitter.alt_texts[media_ids[0]])
+        threads[text] = thread
+    return threads
+
+
+def bsky_threads(bluesky):
+    # url -> alt texts of the replies, checking each one's root
+    roots = dict()
+    threads = dict()
+    last = dict()
+    for uri, record in bluesky.records:
+        if "reply" not in record:
+            url = record["embed"]["external"]["uri"]
+            roots[uri] = url
+            threads[url] = list()
+            last[url] = uri
+            continue
+        url = roots[record["reply"]["root"]["uri"]]
+        assert record["reply"]["parent"]["uri"] == last[url], "reply out of order"
+        threads[url].append(record["embed"]["images"][0]["alt"])
+        last[url] = uri
+    return threads
+
+
+def alt(old, new):
+    return "Before: {}\nAfter: {}".format(old, new)
+
+
+def outbox_status(parser):
+    return sorted(row["status"] for row in parser.outbox_table.all())
+
+
+def test_threads_keep_their_order(poster, networks):
+    twitter, bluesky = networks
+    first, second = titles(1, "T0", "T1", "T2", "T3"), titles(2, "U0", "U1")
+    poll(poster, first[0], second[0])
+    poll(poster, first[1], second[1])
+    poll(poster, first[2])
+    poll(poster, first[3])
+    poster.drain_outbox()
+
+    expected = {
+        "https://example.org/1": [alt("T0", "T1"), alt("T1", "T2"), alt("T2", "T3")],
+        "https://example.org/2": [alt("U0", "U1")],
+    }
+    assert tweet_threads(twitter) == expected
+    assert bsky_threads(bluesky) == expected
+    assert outbox_status(poster) == ["sent"] * 4
+    assert poster.media_locks == {}
+    # One login for all the posts
+    assert len(bluesky.called("/xrpc/com.atproto.server.createSession")) == 1
+
+
+def test_concurrency_per_network(poster, networks, monkeypatch):
+    twitter, bluesky = networks
+    monkeypatch.setattr(nytdiff, "TWITTER_CONCURRENCY", 1)
+    monkeypatch.setattr(nytdiff, "BLUESKY_CONCURRENCY", 2)
+    twitter.latency = bluesky.latency = 0.05
+    poll(poster, *[item(n, "Old") for n in range(6)])
+    poll(poster, *[item(n, "New") for n in range(6)])
+    poster.drain_outbox()
+
+    assert len(twitter.tweets) == 12
+    assert len(bluesky.records) == 12
+    assert twitter.max_in_flight == 1
+    assert bluesky.max_in_flight == 2
+
+
+def test_rate_limits_are_waited_out(poster, networks, monkeypatch):
+    twitter, bluesky = networks
+    monkeypatch.setattr(nytdiff, "MAX_RATE_LIMIT_DELAY", 0.05)
+    reset = {"x-rate-limit-reset": str(int(time.time()) + 60)}
+    twitter.fail("/2/tweets", 429, reset, times=2, after=1)
+    bluesky.fail(
+        "/xrpc/com.atproto.repo.createRecord",
+        429,
+        {"ratelimit-reset": str(int(time.time()) + 60)},
+    )
+    retries = nytdiff.METRICS.counters[("rate_limit_retries", ())]
+    poll(poster, item(1, "Old"))
+    poll(poster, item(1, "New"))
+    start = time.monotonic()
+    poster.drain_outbox()
+
+    assert time.monotonic() - start >= 0.1
+    assert nytdiff.METRICS.counters[("rate_limit_retries", ())] == retries + 3
+    assert tweet_threads(twitter) == {"https://example.org/1": [alt("Old", "New")]}
+    assert bsky_threads(bluesky) == {"https://example.org/1": [alt("Old", "New")]}
+    assert outbox_status(poster) == ["sent"]
+
+
+def test_failed_reply_holds_back_the_next(poster, networks, monkeypatch):
+    twitter, bluesky = networks
+    monkeypatch.setattr(nytdiff, "RETRY_DELAY", 0)
+    # The thread's root is posted, its first reply fails
+    twitter.fail("/2/tweets", 500, after=1)
+    poll(poster, item(1, "T0"))
+    poll(poster, item(1, "T1"))
+    poll(poster, item(1, "T2"))
+    poster.drain_outbox()
+
+    assert tweet_threads(twitter) == {"https://example.org/1": []}
+    assert outbox_status(poster) == ["pending", "pending"]
+    assert [row["bsky_done"] for row in poster.outbox_table.all()] == [True, True]
+
+    poster.drain_outbox()
+    expected = {"https://example.org/1": [alt("T0", "T1"), alt("T1", "T2")]}
+    assert tweet_threads(twitter) == expected
+    # Bluesky isn't posted to again
+    assert bsky_threads(bluesky) == expected
+    assert outbox_status(poster) == ["sent", "sent"]
@@ -0,0 +1,77 @@
+from sqlalchemy import text
+
+import nytdiff
+from conftest import item, poll
+
+BYLINES = ["Jo", None, None, "Al", "Al", None]
+
+
+def store_history(parser):
+    # Six versions of one article, whose byline comes and goes
+    for n, byline in enumerate(BYLINES):
+        poll(parser, item(1, "T{}".format(n), byline=byline))
+
+
+def test_versions_rebuild(parser):
+    store_history(parser)
+    versions = list(parser.history("a1"))
+    assert [v["version"] for v in versions] == [1, 2, 3, 4, 5, 6]
+    assert [v["title"] for v in versions] == ["T0", "T1", "T2", "T3", "T4", "T5"]
+    assert [v["byline"] for v in versions] == BYLINES
+    assert parser.read_version("a1", 3)["byline"] is None
+    assert parser.read_version("a1")["title"] == "T5"
+    # Only the first version holds every field
+    rows = list(parser.versions_table.find(order_by="version"))
+    assert [row["snapshot"] for row in rows] == [True] + [False] * 5
+    assert [row["abstract"] for row in rows] == ["Abstract"] + [None] * 5
+
+
+def test_snapshots_are_taken_periodically(parser, monkeypatch):
+    monkeypatch.setattr(nytdiff, "VERSION_SNAPSHOT_EVERY", 2)
+    store_history(parser)
+    rows = list(parser.versions_table.find(order_by="version"))
+    assert [row["snapshot"] for row in rows] == [True, False] * 3
+    assert [v["byline"] for v in parser.history("a1")] == BYLINES
+    assert parser.read_version("a1", 4)["byline"] == "Al"
+
+
+def test_compaction_keeps_the_history(parser, monkeypatch):
+    # Full rows, as stored by releases before deltas
+    monkeypatch.setattr(nytdiff, "VERSION_SNAPSHOT_EVERY", 0)
+    store_history(parser)
+    before = list(parser.history("a1"))
+    monkeypatch.setattr(nytdiff, "VERSION_SNAPSHOT_EVERY", 10)
+    parser.compact_versions()
+
+    rows = list(parser.versions_table.find(order_by="version"))
+    assert [row["snapshot"] for row in rows] == [True] + [False] * 5
+    after = list(parser.history("a1"))
+    fields = ["version", "url", "title", "abstract", "byline"]
+    assert [[v[f] for f in fields] for v in after] == [
+        [v[f] for f in fields] for v in before
+    ]
+
+
+def test_deltas_without_a_list_of_changes():
+    # Deltas stored before extra_changed existed: None meant unchanged
+    rows = [
+        dict(article_id="a", version=1, snapshot=True, title="T", title_fp="1",
+             byline="Jo"),
+        dict(article_id="a", version=2, snapshot=False, title="U", title_fp="2",
+             byline=None),
+        dict(article_id="a", version=3, snapshot=False, title=None, title_fp="2",
+             byline=None, extra_changed="byline"),
+    ]
+    versions = list(nytdiff.rebuild_versions(rows, ["title"], ["byline"]))
+    assert [v["byline"] for v in versions] == ["Jo", "Jo", None]
+    assert [v["title"] for v in versions] == ["T", "U", "U"]
+
+
+def test_rows_of_a_raw_query(parser):
+    # SQLite gives the snapshot flags of a text query as 0 and 1
+    store_history(parser)
+    rows = parser.db.query(text("SELECT * FROM test_versions ORDER BY version"))
+    fields = ["url", "title", "abstract"]
+    versions = list(nytdiff.rebuild_versions(rows, fields, ["byline"]))
+    assert [v["abstract"] for v in versions] == ["Abstract"] * 6
+    assert [v["byline"] for v in versions] == BYLINES